@@ -1,10 +1,24 @@
 import json
+import os
+import stat
 import tempfile
+import threading
+import uuid
+import zipfile
+from datetime import datetime
 from pathlib import Path
 
 import pytest
 
-from zfdb import Database, DatabaseConfig, DatabaseError, RecordError
+from zfdb import (
+    Database,
+    DatabaseConfig,
+    DatabaseError,
+    Record,
+    RecordError,
+    SecurityError,
+    SimpleEncryption,
+)
 
 
 @pytest.fixture
@@ -82,6 +96,30 @@ def test_insert_and_get_bytes(db):
     assert record.validate()
 
 
+def test_insert_and_get_large(db_config):
+    """Test round trip of a payload spanning many deflate blocks"""
+    db_config.max_size = 10 * 1024 * 1024
+    db = Database(db_config)
+    data = bytes(range(256)) * 4096 + b"tail"
+    db.insert("large", data)
+
+    record = db.get("large")
+    assert record.raw == data
+    assert record.validate()
+
+
+def test_insert_rejects_non_bytes(db):
+    """Test data must be text or a bytes-like object"""
+    with pytest.raises(TypeError):
+        db.insert("number", 5)
+    with pytest.raises(TypeError):
+        db.insert("list", [1, 2, 3])
+
+    db.insert("buffer", bytearray(b"mutable"))
+    assert db.get("buffer").raw == b"mutable"
+    assert db.list_records() == ["buffer"]
+
+
 def test_update_record(db):
     """Test updating existing record"""
     # Insert initial data
@@ -97,6 +135,20 @@ def test_update_record(db):
     assert record.json == new_data
 
 
+def test_update_keeps_metadata(db, db_config):
+    """Test updates carry metadata over without reading the old payload"""
+    inserted = db.insert("item", "v1", {"tag": "a"})
+
+    cold = Database(db_config)
+    cold.update("item", "v2")
+    assert cold.cache_info()["misses"] == 0
+
+    record = cold.get("item")
+    assert record.text == "v2"
+    assert record.metadata["tag"] == "a"
+    assert record.metadata["previous_checksum"] == inserted.metadata["checksum"]
+
+
 def test_delete_record(db):
     """Test deleting a record"""
     # Insert and verify data exists
@@ -108,6 +160,180 @@ def test_delete_record(db):
     assert db.get("delete_test") is None
 
 
+def test_delete_and_reinsert(db, db_config):
+    """Test deleted records are tombstoned until compaction"""
+    db.insert("item", "old data")
+    db.insert("item_other", "other data")
+    db.delete("item")
+
+    assert db.get("item") is None
+    assert db.list_records() == ["item_other"]
+    assert Database(db_config).get("item") is None
+
+    db.insert("item", "new data")
+    assert db.get("item").text == "new data"
+    assert Database(db_config).list_records() == ["item", "item_other"]
+
+
+def test_delete_unknown_records(db):
+    """Test deleting records that do not exist leaves the file alone"""
+    db.insert("item", "data")
+    size = db.path.stat().st_size
+
+    db.delete("missing")
+    db.delete_many([])
+    db.delete_many(["missing", "other"])
+    assert db.path.stat().st_size == size
+    assert db.list_records() == ["item"]
+
+
+def test_update_appends_until_compact(db):
+    """Test updates shadow old entries which compaction reclaims"""
+    db.insert("item", "v1")
+    db.update("item", "v2")
+
+    with zipfile.ZipFile(db.path, "r") as zf:
+        assert zf.namelist().count("data/item") == 2
+
+    db.compact()
+    with zipfile.ZipFile(db.path, "r") as zf:
+        assert zf.namelist().count("data/item") == 1
+    assert db.get("item").text == "v2"
+    assert db.list_records() == ["item"]
+
+
+def test_index_detects_external_changes(db, db_config):
+    """Test record index is rebuilt when another instance changes the file"""
+    db.insert("first", "data")
+    assert db.list_records() == ["first"]
+
+    other_db = Database(db_config)
+    other_db.insert("second", "data")
+    other_db.delete("first")
+
+    assert db.list_records() == ["second"]
+    assert db.get("first") is None
+    assert db.get("second").text == "data"
+
+
+def test_record_names_with_slashes(db, db_config):
+    """Test names containing slashes survive reopening the database"""
+    db.insert("users/alice", "data")
+
+    reopened = Database(db_config)
+    assert reopened.list_records() == ["users/alice"]
+    assert reopened.get("users/alice").text == "data"
+
+
+def test_context_manager_closes_reader(db_config):
+    """Test database used as a context manager releases its archive handle"""
+    with Database(db_config) as db:
+        db.insert("item", "data")
+        assert db.get("item").text == "data"
+        assert db._ro_zip is not None
+    assert db._ro_zip is None
+
+
+def test_concurrent_writers(db, db_config):
+    """Test threads writing the same file through separate objects"""
+
+    def write(worker):
+        writer = Database(db_config)
+        for i in range(20):
+            writer.insert(f"w{worker}-{i}", f"data {worker} {i}")
+            writer.update(f"w{worker}-{i}", f"updated {worker} {i}")
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(db.list_records()) == 80
+    assert db.get("w3-19").text == "updated 3 19"
+    with zipfile.ZipFile(db.path, "r") as zf:
+        assert zf.testzip() is None
+
+
+def test_insert_and_delete_many(db):
+    """Test batch inserts and deletes"""
+    records = db.insert_many(
+        [("bulk1", "data1"), ("bulk2", b"data2"), ("bulk3", "data3")],
+        metadata={"type": "bulk"},
+    )
+    assert [record.name for record in records] == ["bulk1", "bulk2", "bulk3"]
+    assert db.get("bulk2").raw == b"data2"
+    assert db.get("bulk3").metadata["type"] == "bulk"
+
+    with pytest.raises(RecordError):
+        db.insert_many([("new", "data"), ("bulk1", "data")])
+    with pytest.raises(RecordError):
+        db.insert_many([("new", "data"), ("new", "data")])
+    assert db.get("new") is None
+
+    db.delete_many(["bulk1", "bulk3"])
+    assert db.list_records() == ["bulk2"]
+
+
+def test_get_many(db):
+    """Test reading several records at once"""
+    db.insert_many([("a", "data a"), ("b", "data b"), ("c", "data c")])
+    db.delete("c")
+
+    records = db.get_many(["b", "missing", "a", "c", "b"])
+    assert list(records) == ["b", "a"]
+    assert records["a"].text == "data a"
+    assert records["b"].text == "data b"
+    assert db.get_many([]) == {}
+
+
+def test_get_many_workers(secure_db):
+    """Test batches read on a thread pool"""
+    items = [(f"item{i}", f"data {i}" * 100) for i in range(50)]
+    secure_db.insert_many(items)
+    secure_db.get("item3")
+
+    records = secure_db.get_many((name for name, _ in reversed(items)), workers=4)
+    assert list(records) == [name for name, _ in reversed(items)]
+    assert all(records[name].text == data for name, data in items)
+
+
+def test_record_cache(db):
+    """Test repeated reads are served from the record cache"""
+    db.insert("cached", "v1")
+    assert db.get("cached").text == "v1"
+    record = db.get("cached")
+    assert record.text == "v1"
+    assert db.cache_info()["hits"] == 1
+    assert db.cache_info()["misses"] == 1
+
+    # Mutating a returned record must not leak into the cache
+    record.metadata["extra"] = True
+    assert "extra" not in db.get("cached").metadata
+
+    db.update("cached", "v2")
+    assert db.get("cached").text == "v2"
+    db.delete("cached")
+    assert db.get("cached") is None
+
+
+def test_record_cache_scan_resistance(db_config):
+    """Test a one-shot scan does not evict records read repeatedly"""
+    db_config.cache_size = 4
+    db = Database(db_config)
+    db.insert_many([(f"rec{i}", str(i)) for i in range(10)])
+
+    db.get("rec0")
+    db.get("rec0")
+    for i in range(1, 10):
+        db.get(f"rec{i}")
+    assert db.cache_info()["size"] <= 4
+
+    hits = db.cache_info()["hits"]
+    db.get("rec0")
+    assert db.cache_info()["hits"] == hits + 1
+
+
 def test_list_and_search_records(db):
     """Test listing and searching records"""
     # Insert test records
@@ -132,15 +358,43 @@ def test_list_and_search_records(db):
 def test_metadata(db):
     """Test record metadata"""
     metadata = {"type": "test", "tags": ["important"]}
-    db.insert("metadata_test", "test data", metadata=metadata)
+    inserted = db.insert("metadata_test", "test data", metadata=metadata)
 
     record = db.get("metadata_test")
+    assert record.metadata == inserted.metadata
     assert record.metadata["type"] == "test"
     assert record.metadata["tags"] == ["important"]
     assert "created_at" in record.metadata
     assert "checksum" in record.metadata
 
 
+def test_metadata_json_edge_cases(db, db_config):
+    """Test metadata values orjson cannot represent survive a round trip"""
+    db.insert("big", "data", metadata={"n": 2**70})
+    db.insert("inf", "data", metadata={"ratio": float("inf")})
+
+    reopened = Database(db_config)
+    metadata = reopened.get("big").metadata
+    assert metadata["n"] == 2**70
+    assert isinstance(metadata["n"], int)
+    assert reopened.get("inf").metadata["ratio"] == float("inf")
+
+    with pytest.raises(TypeError):
+        db.insert("when", "data", metadata={"at": datetime.now()})
+    with pytest.raises(TypeError):
+        db.insert("id", "data", metadata={"id": uuid.uuid4()})
+
+
+def test_record_json_edge_cases(db):
+    """Test JSON payloads are parsed like the json module does"""
+    db.insert("doc", '{"n": %d, "values": [NaN, 1.5]}' % 2**70)
+
+    parsed = db.get("doc").json
+    assert parsed["n"] == 2**70
+    assert isinstance(parsed["n"], int)
+    assert parsed["values"][1] == 1.5
+
+
 def test_secure_database(secure_db):
     """Test encrypted database operations"""
     data = {"secret": "value"}
@@ -151,6 +405,160 @@ def test_secure_database(secure_db):
     assert record.validate()
 
 
+def test_encryption_roundtrip_sizes():
+    """Test XOR encryption on both the small and the vectorized path"""
+    encryption = SimpleEncryption("secret123")
+    for size in (0, 1, 31, 32, 63, 64, 65, 1000, 4096):
+        data = bytes(i % 256 for i in range(size))
+        encrypted = encryption.encrypt(data)
+        assert encryption.decrypt(encrypted) == data
+        if size:
+            assert encrypted != data
+
+
+def test_legacy_cipher_database(secure_db_config):
+    """Test reading a database written with base64 wrapped XOR"""
+    legacy = SimpleEncryption("secret123", cipher="xor-v1")
+    with zipfile.ZipFile(secure_db_config.path, "w") as zf:
+        zf.writestr(
+            "__metadata__.json",
+            json.dumps({"version": "1.0.0", "encryption": True}),
+        )
+    db = Database(secure_db_config)
+    db.insert("legacy", "legacy data")
+
+    with zipfile.ZipFile(secure_db_config.path, "r") as zf:
+        stored = zf.read("data/legacy")
+    payload_start = 4 + int.from_bytes(stored[:4], "big")
+    assert legacy.decrypt(stored[payload_start:]) == b"legacy data"
+    assert db.get("legacy").text == "legacy data"
+
+
+def test_password_on_unencrypted_database(db, db_config):
+    """Test a password is refused for a database written without one"""
+    db.insert("plain", "plain data")
+
+    db_config.password = "secret123"
+    with pytest.raises(SecurityError):
+        Database(db_config)
+
+
+def test_record_format_migration(db_config):
+    """Test separate metadata entries are folded into record entries"""
+    with zipfile.ZipFile(db_config.path, "w") as zf:
+        zf.writestr("__metadata__.json", json.dumps({"version": "1.0.0"}))
+        zf.writestr("data/old", "old data")
+        zf.writestr("metadata/old.json", json.dumps({"type": "legacy"}))
+
+    db = Database(db_config)
+    record = db.get("old")
+    assert record.text == "old data"
+    assert record.metadata["type"] == "legacy"
+    with zipfile.ZipFile(db_config.path, "r") as zf:
+        assert zf.namelist() == ["data/old", "__metadata__.json"]
+
+
+def test_newer_record_format(db_config):
+    """Test a database written by a newer version is not rewritten"""
+    metadata = {"version": "1.0.0", "record_format": 99}
+    with zipfile.ZipFile(db_config.path, "w") as zf:
+        zf.writestr("__metadata__.json", json.dumps(metadata))
+        zf.writestr("data/new", "new data")
+    size = db_config.path.stat().st_size
+
+    with pytest.raises(DatabaseError):
+        Database(db_config)
+    assert db_config.path.stat().st_size == size
+
+
+def test_secure_database_wrong_password(secure_db, secure_db_config):
+    """Test that a wrong password cannot read encrypted records"""
+    # XOR has no authentication, only AES-GCM detects a wrong key
+    pytest.importorskip("cryptography")
+    secure_db.insert("secure_test", "secret data")
+
+    secure_db_config.password = "wrong"
+    other_db = Database(secure_db_config)
+    with pytest.raises(DatabaseError):
+        other_db.get("secure_test")
+
+
+def test_compression_profile():
+    """Test compression profiles map to deflate levels"""
+    config = DatabaseConfig(name="test", path=Path("test.zip"))
+    assert config.compression_level == 1
+
+    config = DatabaseConfig(
+        name="test", path=Path("test.zip"), compression_profile="max"
+    )
+    assert config.compression_level == 9
+
+    config = DatabaseConfig.from_dict(
+        {"name": "test", "path": "test.zip", "compression_profile": "fast"}
+    )
+    assert config.compression_level == 1
+
+    with pytest.raises(DatabaseError):
+        DatabaseConfig(name="test", path=Path("test.zip"), compression_profile="x")
+
+
+def test_record_compress_type(db):
+    """Test small and already compressed payloads skip deflate"""
+    db.insert("small", "tiny")
+    db.insert("text", "text " * 1000)
+    db.insert("image", b"\x89PNG\r\n\x1a\n" + bytes(1000))
+    db.insert("forced", "text " * 1000, compress_type=zipfile.ZIP_STORED)
+    db.insert("text2", "text " * 1000)
+    db.update("text2", "other " * 1000, compress_type=zipfile.ZIP_STORED)
+    db.compact()
+
+    with zipfile.ZipFile(db.path, "r") as zf:
+        types = {info.filename: info.compress_type for info in zf.infolist()}
+    assert types["data/small"] == zipfile.ZIP_STORED
+    assert types["data/text"] == zipfile.ZIP_DEFLATED
+    assert types["data/image"] == zipfile.ZIP_STORED
+    assert types["data/forced"] == zipfile.ZIP_STORED
+    assert types["data/text2"] == zipfile.ZIP_STORED
+    assert db.get("text2").text == "other " * 1000
+
+    with pytest.raises(DatabaseError):
+        db.insert("lzma", "data", compress_type=zipfile.ZIP_LZMA)
+
+
+def test_metadata_entry_stored(db):
+    """Test the small database metadata entry skips deflate"""
+    db.insert("item", "x" * 1000)
+    with zipfile.ZipFile(db.path, "r") as zf:
+        assert zf.getinfo("__metadata__.json").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("data/item").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_zstd_backend(db_config):
+    """Test zstd backend round trip and dictionary training on compact"""
+    pytest.importorskip("zstandard")
+    db_config.backend = "zstd"
+    db = Database(db_config)
+    records = [
+        (f"user{i}", json.dumps({"id": i, "name": f"user {i}"})) for i in range(64)
+    ]
+    db.insert_many(records, metadata={"type": "user"})
+    assert db.get("user1").json == {"id": 1, "name": "user 1"}
+
+    db.delete("user0")
+    db.compact()
+    with zipfile.ZipFile(db.path, "r") as zf:
+        assert "__zstd_dict__" in zf.namelist()
+        assert zf.getinfo("data/user1").compress_type == zipfile.ZIP_STORED
+
+    db.insert("late", "written with the dictionary")
+    reopened = Database(DatabaseConfig(name="test", path=db_config.path))
+    assert reopened.get("late").text == "written with the dictionary"
+    for name, data in records[1:]:
+        record = reopened.get(name)
+        assert record.text == data
+        assert record.validate()
+
+
 def test_database_size_limit(db_config):
     """Test database size limit enforcement"""
     config = db_config
@@ -192,6 +600,39 @@ def test_database_size_validation(db_config):
     assert "exceeds size limit" in str(exc_info.value)
 
 
+def test_auto_compact_on_updates(db_config):
+    """Test repeated updates stay within max_size and the file reopens"""
+    db = Database(db_config)
+    db.insert("item", os.urandom(8192))
+    for _ in range(200):
+        db.update("item", os.urandom(8192))
+    assert db.path.stat().st_size < db_config.max_size
+
+    data = os.urandom(8192)
+    db.update("item", data)
+    assert Database(db_config).get("item").raw == data
+
+
+def test_open_compacts_oversized_database(db_config):
+    """Test opening a file over max_size reclaims garbage with auto_compact"""
+    db_config.auto_compact = False
+    db = Database(db_config)
+    db.insert("item", os.urandom(8192))
+    for _ in range(200):
+        db.update("item", os.urandom(8192))
+    size = db.path.stat().st_size
+    assert size > db_config.max_size
+
+    with pytest.raises(DatabaseError):
+        Database(db_config)
+    assert db.path.stat().st_size == size
+
+    db_config.auto_compact = True
+    reopened = Database(db_config)
+    assert reopened.path.stat().st_size < 20_000
+    assert reopened.get("item").raw == db.get("item").raw
+
+
 def test_database_size_tracking(db_config):
     """Test accurate size tracking of database"""
     config = db_config
@@ -215,6 +656,13 @@ def test_database_size_tracking(db_config):
     assert final_size < new_size
 
 
+def test_invalid_database_file(db_config):
+    """Test opening a file that is not an archive"""
+    Path(db_config.path).write_bytes(b"not a zip file")
+    with pytest.raises(DatabaseError):
+        Database(db_config)
+
+
 def test_duplicate_record(db):
     """Test handling of duplicate records"""
     db.insert("duplicate", "original")
@@ -248,6 +696,69 @@ def test_backup_restore(db, temp_dir):
     assert record.text == "test data"
 
 
+def test_compaction_reproducible(db):
+    """Test compacting the same content yields identical archives"""
+    db.insert("a", "data a")
+    db.insert("b", "data b")
+    db.compact()
+    first = db.path.read_bytes()
+
+    db.compact()
+    assert db.path.read_bytes() == first
+    with zipfile.ZipFile(db.path, "r") as zf:
+        assert zf.testzip() is None
+
+
+def test_compaction_recompresses_foreign_entries(db):
+    """Test compaction deflates record entries written with another method"""
+    db.insert("big", "x" * 100_000)
+    db.close()
+    with zipfile.ZipFile(db.path, "a") as zf:
+        entry = zf.read("data/big")
+        with pytest.warns(UserWarning):
+            zf.writestr("data/big", entry, compress_type=zipfile.ZIP_BZIP2)
+
+    db.compact()
+    with zipfile.ZipFile(db.path, "r") as zf:
+        info = zf.getinfo("data/big")
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert info.compress_size < 1000
+    assert db.get("big").text == "x" * 100_000
+
+
+@pytest.mark.parametrize("durable", [True, False])
+def test_compaction_durability(db_config, monkeypatch, durable):
+    """Test durable compaction fsyncs the new archive"""
+    db_config.durable = durable
+    db = Database(db_config)
+    db.insert("item", "data")
+
+    synced = []
+    monkeypatch.setattr("os.fsync", synced.append)
+    db.compact()
+    assert bool(synced) == durable
+    assert db.get("item").text == "data"
+
+
+def test_compaction_directory_fsync_failure(db, monkeypatch):
+    """Test a failing directory fsync does not fail a finished compaction"""
+    db.insert("keep", "data")
+    db.insert("drop", "data")
+    db.delete("drop")
+
+    real_fsync = os.fsync
+
+    def fsync(fd):
+        if stat.S_ISDIR(os.fstat(fd).st_mode):
+            raise OSError("fsync not supported")
+        real_fsync(fd)
+
+    monkeypatch.setattr("os.fsync", fsync)
+    db.compact()
+    assert db.list_records() == ["keep"]
+    assert Database(db.config).list_records() == ["keep"]
+
+
 def test_compaction(db):
     """Test database compaction"""
     # Insert and delete some records
@@ -267,6 +778,15 @@ def test_compaction(db):
     assert "keep" in records
 
 
+def test_record_view(db):
+    """Test memoryview access to record data"""
+    db.insert("blob", b"header" + bytes(1000))
+    view = db.get("blob").view()
+    assert view.readonly
+    assert view[:6] == b"header"
+    assert len(view) == 1006
+
+
 def test_record_validation(db):
     """Test record validation"""
     db.insert("validate", "test data")
@@ -280,6 +800,26 @@ def test_record_validation(db):
     assert not record.validate()
 
 
+def test_record_encryption_deprecated():
+    """Test the record encryption argument is still accepted"""
+    with pytest.warns(DeprecationWarning):
+        record = Record("name", "data", encryption=SimpleEncryption("secret123"))
+    assert record.text == "data"
+
+
+def test_stored_record_corruption(db):
+    """Test validation of a record whose stored data no longer matches"""
+    db.insert("validate", "test data")
+    with zipfile.ZipFile(db.path, "a") as zf:
+        header = zf.read("data/validate")[: -len("test data")]
+        with pytest.warns(UserWarning):
+            zf.writestr("data/validate", header + b"tampered")
+
+    record = db.get("validate")
+    assert record.text == "tampered"
+    assert not record.validate()
+
+
 def test_record_updates(db):
     """Test to verify record updates are working correctly"""
 
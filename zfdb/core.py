@@ -1,13 +1,285 @@
 import base64
+import functools
 import hashlib
 import json
+import math
+import os
+import re
 import shutil
+import struct
 import tempfile
+import threading
+import warnings
 import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import (
+    IO,
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is an optional speedup
+    np = None  # type: ignore[assignment]
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:  # pragma: no cover - only XOR ciphers are available
+    AESGCM = None  # type: ignore[assignment,misc]
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speedup
+    orjson = None  # type: ignore[assignment]
+
+try:
+    from isal import isal_zlib
+except ImportError:  # pragma: no cover - isal is an optional speedup
+    isal_zlib = None  # type: ignore[assignment]
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - only the zip backend is available
+    zstandard = None  # type: ignore[assignment]
+
+# Archive entry holding database level metadata
+METADATA_ENTRY = "__metadata__.json"
+# Archive entry holding the trained dictionary of the zstd backend
+ZSTD_DICT_ENTRY = "__zstd_dict__"
+ZSTD_DICT_SIZE = 16 * 1024
+# Records needed before compact() trains a zstd dictionary
+_ZSTD_DICT_MIN_SAMPLES = 8
+
+# Fixed entry timestamp, record times live in metadata and this keeps archives
+# with the same content byte for byte identical
+_ENTRY_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# ZIP local file header: signature, versions, flags, compression, time, date,
+# CRC, sizes, then the file name and extra field lengths
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+# Chunk size used when streaming entries between archives, and the file
+# buffer of sequential archive passes
+_BUFFER_SIZE = 1 << 20
+# File modes zipfile itself uses for each archive mode
+_FILE_MODES = {"r": "rb", "w": "w+b", "a": "r+b"}
+
+# Record entries hold a length prefixed metadata header before the payload,
+# format 1 stored metadata in separate metadata/{name}.json entries
+RECORD_FORMAT = 2
+_HEADER_SIZE = 4
+
+# Deflate levels for DatabaseConfig.compression_profile
+COMPRESSION_PROFILES = {"fast": 1, "balanced": 6, "max": 9}
+
+# Cipher identifiers stored in __metadata__.json
+CIPHER_XOR_LEGACY = "xor-v1"  # XOR + base64, written by 1.0.x
+CIPHER_XOR = "xor-v2"  # raw XOR bytes
+CIPHER_AES_GCM = "aes-gcm"  # nonce + AES-256-GCM ciphertext and tag
+
+# Payloads stored without deflate by default, deflating them costs CPU and
+# saves next to nothing: tiny payloads, and formats that are already compressed
+_STORED_MAX_SIZE = 128
+_COMPRESSED_MAGIC = (
+    b"\x89PNG",  # PNG
+    b"\xff\xd8\xff",  # JPEG
+    b"GIF8",  # GIF
+    b"PK\x03\x04",  # ZIP and ZIP based formats
+    b"\x1f\x8b",  # gzip
+    b"BZh",  # bzip2
+    b"\xfd7zXZ",  # xz
+    b"\x28\xb5\x2f\xfd",  # zstd
+)
+# Compression methods accepted for record entries of the zip backend
+_RECORD_COMPRESS_TYPES = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+
+# Archive bytes of an entry besides its data: local and central directory
+# headers, each followed by the entry name
+_ENTRY_OVERHEAD = 30 + 46
+# auto_compact rewrites the archive once shadowed and deleted entries take at
+# least this many bytes and this share of the file
+_AUTO_COMPACT_MIN_GARBAGE = 64 * 1024
+_AUTO_COMPACT_RATIO = 0.5
+
+# orjson serializes some types json rejects, leave them to json
+_ORJSON_OPTIONS = (
+    (
+        orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_SUBCLASS
+    )
+    if orjson is not None
+    else 0
+)
+
+# Digit runs long enough to hold an integer over 64 bits
+_LONG_NUMBER = re.compile(rb"[0-9]{20}")
+
+# Payloads shorter than this are XORed in pure Python, numpy setup costs more
+_NUMPY_MIN_SIZE = 64
+
+
+def _orjson_safe(obj: Any) -> bool:
+    """Check orjson writes a value exactly like json, which it does not for
+    non-finite floats (written as null), non-string keys or UUIDs"""
+    if isinstance(obj, float):
+        return math.isfinite(obj)
+    if isinstance(obj, dict):
+        return all(
+            isinstance(key, str) and _orjson_safe(value) for key, value in obj.items()
+        )
+    if isinstance(obj, (list, tuple)):
+        return all(_orjson_safe(value) for value in obj)
+    # Anything else, like a UUID orjson cannot pass through, goes to json
+    return obj is None or isinstance(obj, (str, int))
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Serialize to UTF-8 JSON bytes, using orjson when it matches json"""
+    if orjson is not None and _orjson_safe(obj):
+        try:
+            # Types json rejects (datetime, dataclasses, subclasses) are passed
+            # through to the fallback below, so they fail the same either way
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # Integers over 64 bits and other values orjson rejects
+            pass
+    return json.dumps(obj).encode("utf-8")
+
+
+def _json_loads(data: Union[bytes, str]) -> Any:
+    """
+    Parse our own JSON metadata, using orjson when available.
+
+    orjson reads integers over 64 bits as floats and rejects NaN, such
+    documents are parsed with json. User payloads always go through json.
+    """
+    if orjson is not None:
+        raw = data.encode("utf-8") if isinstance(data, str) else data
+        if _LONG_NUMBER.search(raw) is None:
+            try:
+                return orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                pass
+    return json.loads(data)
+
+
+def _open_entry(zf: zipfile.ZipFile, name: Union[str, zipfile.ZipInfo]) -> IO[bytes]:
+    """Open an archive entry for reading, inflating with ISA-L when available"""
+    f: Any = zf.open(name)
+    if isal_zlib is not None and f._compress_type == zipfile.ZIP_DEFLATED:
+        # Nothing has been read yet, so the zlib inflater can be swapped out
+        f._decompressor = isal_zlib.decompressobj(-zlib.MAX_WBITS)
+    return f
+
+
+# One lock per database file, shared by every Database object of this process
+# opened on it, so writers of different files never wait for each other
+_PATH_LOCKS: Dict[str, Any] = {}
+_PATH_LOCKS_GUARD = threading.Lock()
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def _path_lock(path: Path) -> Any:
+    """Get the reentrant lock guarding a database file"""
+    key = os.path.realpath(path)
+    with _PATH_LOCKS_GUARD:
+        lock = _PATH_LOCKS.get(key)
+        if lock is None:
+            lock = _PATH_LOCKS[key] = threading.RLock()
+    return lock
+
+
+def _locked(method: _F) -> _F:
+    """Run a Database method while holding the lock of its file"""
+
+    @functools.wraps(method)
+    def wrapper(self: "Database", *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def _as_bytes(data: Union[bytes, str]) -> bytes:
+    """Normalize record data to immutable bytes, encoding text as UTF-8"""
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    if isinstance(data, bytes):
+        return data
+    # Copies mutable buffers and raises TypeError for anything not bytes-like,
+    # where bytes() would turn an int into zero bytes
+    return memoryview(data).tobytes()
+
+
+@contextmanager
+def _buffered_zip(
+    path: Path, mode: Literal["r", "w", "a"], sync: bool = False, **kwargs: Any
+) -> Iterator[zipfile.ZipFile]:
+    """
+    Open an archive through a large file buffer.
+
+    Meant for passes that walk or write the archive sequentially, random
+    access reads are better served by the default buffer.
+
+    :param sync: fsync the file once the archive is closed
+    """
+    with open(path, _FILE_MODES[mode], buffering=_BUFFER_SIZE) as fp:
+        with zipfile.ZipFile(fp, mode, **kwargs) as zf:
+            yield zf
+        if sync:
+            fp.flush()
+            os.fsync(fp.fileno())
+
+
+def _fsync_dir(path: Path):
+    """Persist renames within a directory, a no-op where it cannot be synced"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Some filesystems refuse fsync on directories, the rename is done
+        pass
+    finally:
+        os.close(fd)
+
+
+def _pack_record(metadata: bytes, payload: bytes) -> bytes:
+    """Build a record entry from serialized metadata and stored payload"""
+    return len(metadata).to_bytes(_HEADER_SIZE, "big") + metadata + payload
+
+
+def _unpack_record(blob: bytes) -> Tuple[bytes, memoryview]:
+    """Split a record entry into serialized metadata and stored payload"""
+    view = memoryview(blob)
+    end = _HEADER_SIZE + int.from_bytes(view[:_HEADER_SIZE], "big")
+    return bytes(view[_HEADER_SIZE:end]), view[end:]
 
 
 class DatabaseError(Exception):
@@ -35,10 +307,32 @@ class DatabaseConfig:
     name: str
     path: Path
     password: Optional[str] = None
-    compression_level: int = 6
+    compression_level: int = 1
     max_size: int = 1024 * 1024  # 1 MB
     auto_compact: bool = True
-    version: str = "1.0.0"
+    version: str = "1.1.0"
+    # Overrides compression_level when set
+    compression_profile: Optional[Literal["fast", "balanced", "max"]] = None
+    # Record compression, "zstd" compresses records with zstandard and a
+    # dictionary trained on compact(), existing databases keep their backend
+    backend: Literal["zip", "zstd"] = "zip"
+    # Number of records kept in memory by get(), 0 disables caching
+    cache_size: int = 128
+    # Share of cache_size for records read once, the rest holds repeat reads
+    cache_in_fraction: float = 0.25
+    # Evicted one-shot keys remembered, relative to cache_size
+    cache_out_fraction: float = 0.5
+    # fsync the archive written by compact() and its directory entry, so a
+    # crash right after compaction cannot leave a truncated database
+    durable: bool = True
+
+    def __post_init__(self):
+        if self.compression_profile is not None:
+            if self.compression_profile not in COMPRESSION_PROFILES:
+                raise DatabaseError(
+                    f"Unknown compression profile: {self.compression_profile}"
+                )
+            self.compression_level = COMPRESSION_PROFILES[self.compression_profile]
 
     @staticmethod
     def from_dict(data: Dict[str, Any]) -> "DatabaseConfig":
@@ -52,18 +346,30 @@ class DatabaseConfig:
             name=data["name"],
             path=Path(data["path"]),
             password=data.get("password"),
-            compression_level=data.get("compression_level", 6),
+            compression_level=data.get("compression_level", 1),
             max_size=data.get("max_size", 1024 * 1024),
             auto_compact=data.get("auto_compact", True),
-            version=data.get("version", "1.0.0"),
+            version=data.get("version", "1.1.0"),
+            compression_profile=data.get("compression_profile"),
+            backend=data.get("backend", "zip"),
+            cache_size=data.get("cache_size", 128),
+            cache_in_fraction=data.get("cache_in_fraction", 0.25),
+            cache_out_fraction=data.get("cache_out_fraction", 0.5),
+            durable=data.get("durable", True),
         )
 
 
 class SimpleEncryption:
     """Simple encryption using XOR with a key derived from password"""
 
-    def __init__(self, password: Optional[str] = None):
+    def __init__(self, password: Optional[str] = None, cipher: str = CIPHER_XOR):
+        if cipher not in (CIPHER_XOR, CIPHER_XOR_LEGACY):
+            raise SecurityError(f"Unsupported cipher: {cipher}")
+        self.cipher = cipher
         self.key: Optional[bytes] = None
+        # Repeated key reused between calls, grown to the largest payload seen
+        self._cached_keystream = b""
+        self._keystream_arr: Any = None
         if password:
             # Create a repeatable key from password using SHA-256
             key_hash = hashlib.sha256(password.encode()).digest()
@@ -71,50 +377,150 @@ class SimpleEncryption:
         else:
             self.key = None
 
+    def _keystream(self, size: int) -> bytes:
+        """Get the repeated key, at least size bytes long"""
+        assert self.key is not None
+        if len(self._cached_keystream) < size:
+            # Grow to the next power of two so regrowth stays rare
+            length = max(len(self.key), 1 << (size - 1).bit_length())
+            self._cached_keystream = self.key * (length // len(self.key))
+            if np is not None:
+                self._keystream_arr = np.frombuffer(
+                    self._cached_keystream, dtype=np.uint8
+                )
+        return self._cached_keystream
+
+    def _xor(self, data: Union[bytes, memoryview]) -> bytes:
+        """XOR data with the repeated key, using numpy if available"""
+        keystream = self._keystream(len(data))
+        if self._keystream_arr is not None and len(data) >= _NUMPY_MIN_SIZE:
+            arr = np.frombuffer(data, dtype=np.uint8)
+            key_arr = self._keystream_arr[: arr.size]
+            return np.bitwise_xor(arr, key_arr).tobytes()
+
+        # zip stops at the end of data, no need to slice the keystream
+        return bytes(a ^ b for a, b in zip(data, keystream))
+
     def encrypt(self, data: bytes) -> bytes:
         """Encrypt data using XOR with key"""
         if not self.key:
             return data
 
-        key_bytes = self.key * (len(data) // len(self.key) + 1)
-        key_bytes = key_bytes[: len(data)]
+        encrypted = self._xor(data)
+        if self.cipher == CIPHER_XOR_LEGACY:
+            return base64.b64encode(encrypted)
+        return encrypted
 
-        encrypted = bytes(a ^ b for a, b in zip(data, key_bytes))
-        return base64.b64encode(encrypted)
-
-    def decrypt(self, data: bytes) -> bytes:
+    def decrypt(self, data: Union[bytes, memoryview]) -> bytes:
         """Decrypt data using XOR with key"""
         if not self.key:
-            return data
+            return bytes(data)
+
+        if self.cipher == CIPHER_XOR_LEGACY:
+            data = base64.b64decode(data)
+        return self._xor(data)
 
-        data = base64.b64decode(data)
-        key_bytes = self.key * (len(data) // len(self.key) + 1)
-        key_bytes = key_bytes[: len(data)]
 
-        return bytes(a ^ b for a, b in zip(data, key_bytes))
+class AESEncryption:
+    """Authenticated AES-256-GCM encryption with a key derived from password"""
+
+    NONCE_SIZE = 12
+    cipher = CIPHER_AES_GCM
+
+    def __init__(self, password: str):
+        if AESGCM is None:
+            raise SecurityError("AES-GCM encryption requires 'cryptography' package")
+        self._aesgcm = AESGCM(hashlib.sha256(password.encode()).digest())
+
+    def encrypt(self, data: bytes) -> bytes:
+        """Encrypt data with a random nonce prepended to the ciphertext"""
+        nonce = os.urandom(self.NONCE_SIZE)
+        return nonce + self._aesgcm.encrypt(nonce, data, None)
+
+    def decrypt(self, data: Union[bytes, memoryview]) -> bytes:
+        """Decrypt and authenticate data produced by encrypt"""
+        nonce, ciphertext = data[: self.NONCE_SIZE], data[self.NONCE_SIZE :]
+        try:
+            return self._aesgcm.decrypt(nonce, ciphertext, None)
+        except InvalidTag:
+            raise SecurityError("Decryption failed: wrong password or corrupted data")
+
+
+Encryption = Union[SimpleEncryption, AESEncryption]
+
+
+def _create_encryption(password: str, cipher: Optional[str] = None) -> Encryption:
+    """
+    Create encryption for the given cipher.
+
+    :param password: Password to derive the key from
+    :param cipher: Cipher identifier, AES-GCM (or XOR without 'cryptography')
+        is used for new databases when omitted
+    :return: Encryption instance
+    """
+    if cipher is None:
+        cipher = CIPHER_AES_GCM if AESGCM is not None else CIPHER_XOR
+    if cipher == CIPHER_AES_GCM:
+        return AESEncryption(password)
+    return SimpleEncryption(password, cipher)
 
 
 class Record:
-    """Enhanced record class with metadata and encryption support"""
+    """Enhanced record class with metadata support"""
 
     def __init__(
         self,
         name: str,
         data: Union[bytes, str],
         metadata: Optional[Dict[str, Any]] = None,
-        encryption: Optional[SimpleEncryption] = None,
+        encryption: Optional[Encryption] = None,
     ):
+        if encryption is not None:
+            # The database encrypts the stored payload, a Record holds plain data
+            warnings.warn(
+                "Record encryption is deprecated and ignored",
+                DeprecationWarning,
+                stacklevel=2,
+            )
         self.name = name
-        self._raw_data = data if isinstance(data, bytes) else data.encode("utf-8")
+        # Keep immutable bytes so hashlib can hash the buffer without copying
+        self._data = _as_bytes(data)
+        self._checksum = self._calculate_checksum()
+        self._dirty = False
         self.metadata = metadata or {}
         self.metadata.update(
             {
                 "created_at": datetime.utcnow().isoformat(),
                 "size": len(self._raw_data),
-                "checksum": self._calculate_checksum(),
+                "checksum": self._checksum,
             }
         )
-        self._encryption = encryption
+
+    @classmethod
+    def _from_storage(
+        cls, name: str, data: bytes, metadata: Dict[str, Any]
+    ) -> "Record":
+        """
+        Create a record from stored data and metadata without rehashing it.
+
+        The stored checksum is trusted until validate() verifies the data.
+        """
+        record = cls.__new__(cls)
+        record.name = name
+        record._data = data
+        record._checksum = metadata.get("checksum", "")
+        record._dirty = True
+        record.metadata = metadata
+        return record
+
+    @property
+    def _raw_data(self) -> bytes:
+        return self._data
+
+    @_raw_data.setter
+    def _raw_data(self, value: bytes):
+        self._data = _as_bytes(value)
+        self._dirty = True
 
     def _calculate_checksum(self) -> str:
         """Calculate SHA-256 checksum of the data"""
@@ -123,10 +529,12 @@ class Record:
     @property
     def raw(self) -> bytes:
         """Get raw bytes data"""
-        if self._encryption:
-            return self._encryption.decrypt(self._raw_data)
         return self._raw_data
 
+    def view(self) -> memoryview:
+        """Get a read-only view of the data, slicing it copies nothing"""
+        return memoryview(self._raw_data)
+
     @property
     def text(self) -> str:
         """Get text representation of data"""
@@ -135,11 +543,145 @@ class Record:
     @property
     def json(self) -> Any:
         """Get JSON parsed data if possible"""
-        return json.loads(self.text)
+        return json.loads(self.raw)
 
     def validate(self) -> bool:
         """Validate record integrity"""
-        return self._calculate_checksum() == self.metadata.get("checksum")
+        if self._dirty:
+            self._checksum = self._calculate_checksum()
+            self._dirty = False
+        return self._checksum == self.metadata.get("checksum")
+
+
+class _DeflateCodec:
+    """Record entries deflated by zipfile"""
+
+    name = "zip"
+    compress_type = zipfile.ZIP_DEFLATED
+    dict_data: Optional[bytes] = None
+
+    def encode(self, blob: bytes) -> bytes:
+        return blob
+
+    def decode(self, blob: bytes) -> bytes:
+        return blob
+
+
+class _ZstdCodec:
+    """Record entries compressed with zstandard and an optional dictionary"""
+
+    name = "zstd"
+    compress_type = zipfile.ZIP_STORED
+
+    def __init__(self, level: int, dict_data: Optional[bytes] = None):
+        if zstandard is None:
+            raise DatabaseError("zstd backend requires 'zstandard' package")
+        self.level = level
+        self.dict_data = dict_data
+        zdict = zstandard.ZstdCompressionDict(dict_data) if dict_data else None
+        self._compressor = zstandard.ZstdCompressor(level=level, dict_data=zdict)
+        self._decompressor = zstandard.ZstdDecompressor(dict_data=zdict)
+
+    def encode(self, blob: bytes) -> bytes:
+        return self._compressor.compress(blob)
+
+    def decode(self, blob: bytes) -> bytes:
+        # Frames written before a dictionary existed decode with it as well
+        return self._decompressor.decompress(blob)
+
+    @staticmethod
+    def train(samples: Iterable[bytes]) -> Optional[bytes]:
+        """Train a dictionary, None if the samples are not enough"""
+        try:
+            return zstandard.train_dictionary(ZSTD_DICT_SIZE, list(samples)).as_bytes()
+        except zstandard.ZstdError:
+            return None
+
+
+Codec = Union[_DeflateCodec, _ZstdCodec]
+
+
+class _TwoQueueCache:
+    """
+    Scan resistant 2Q cache with hit and miss counters.
+
+    New values enter the FIFO ``a1in`` queue and are promoted to the LRU ``am``
+    queue when accessed again, so a single pass over many records only churns
+    ``a1in``. Keys evicted from ``a1in`` are remembered in the ``a1out`` ghost
+    queue and go straight to ``am`` if they are read back soon after.
+    """
+
+    def __init__(
+        self, maxsize: int, in_fraction: float = 0.25, out_fraction: float = 0.5
+    ):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._in_size = min(maxsize, max(1, int(maxsize * in_fraction)))
+        self._am_size = maxsize - self._in_size
+        self._out_size = int(maxsize * out_fraction)
+        self._a1in: "OrderedDict[str, Any]" = OrderedDict()
+        self._am: "OrderedDict[str, Any]" = OrderedDict()
+        self._a1out: "OrderedDict[str, None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._a1in) + len(self._am)
+
+    def get(self, key: str) -> Any:
+        """Get a cached value or None, promoting values read twice"""
+        if key in self._am:
+            self._am.move_to_end(key)
+            self.hits += 1
+            return self._am[key]
+        if key in self._a1in:
+            self.hits += 1
+            value = self._a1in[key]
+            if self._am_size > 0:
+                del self._a1in[key]
+                self._put_am(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: Any):
+        """Cache a value read from storage"""
+        if self.maxsize <= 0:
+            return
+        if key in self._am:
+            self._am[key] = value
+            self._am.move_to_end(key)
+        elif key in self._a1out and self._am_size > 0:
+            del self._a1out[key]
+            self._put_am(key, value)
+        else:
+            self._a1in[key] = value
+            if len(self._a1in) > self._in_size:
+                evicted, _ = self._a1in.popitem(last=False)
+                self._a1out[evicted] = None
+                if len(self._a1out) > self._out_size:
+                    self._a1out.popitem(last=False)
+
+    def _put_am(self, key: str, value: Any):
+        self._am[key] = value
+        if len(self._am) > self._am_size:
+            self._am.popitem(last=False)
+
+    def peek(self, key: str) -> Any:
+        """Get a cached value without counting it as an access"""
+        if key in self._am:
+            return self._am[key]
+        return self._a1in.get(key)
+
+    def pop(self, key: str):
+        """Drop a cached value if present"""
+        self._a1in.pop(key, None)
+        self._am.pop(key, None)
+
+    def clear(self):
+        """Drop all cached values"""
+        self._a1in.clear()
+        self._am.clear()
+        self._a1out.clear()
 
 
 class Database:
@@ -148,203 +690,727 @@ class Database:
     def __init__(self, config: DatabaseConfig):
         self.config = config
         self.path = Path(config.path)
-        self._encryption = (
-            SimpleEncryption(config.password) if config.password else None
+        self._encryption: Optional[Encryption] = (
+            _create_encryption(config.password) if config.password else None
+        )
+        self._metadata: Dict[str, Any] = {}
+        self._tombstones: Set[str] = set()
+        # Live record names in archive order, a dict is used as an ordered set
+        self._names: Dict[str, None] = {}
+        self._stat: Optional[Tuple[int, int]] = None
+        # Bytes of shadowed and deleted entries that compact() would reclaim
+        self._garbage = 0
+        # Read-only handle reused between reads, closed before every mutation
+        self._ro_zip: Optional[zipfile.ZipFile] = None
+        # Decrypted data and serialized metadata of recently read records
+        self._cache = _TwoQueueCache(
+            config.cache_size, config.cache_in_fraction, config.cache_out_fraction
         )
-        self._validate_or_create()
+        self._codec = self._create_codec(config.backend)
+        # Serializes archive access of all threads using this file
+        self._lock = _path_lock(self.path)
+        with self._lock:
+            self._validate_or_create()
+
+    def __enter__(self) -> "Database":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @_locked
+    def close(self):
+        """Close the cached archive handle"""
+        self._close_reader()
+
+    def _reader(self) -> zipfile.ZipFile:
+        """Get the cached read-only archive handle, opening it on demand"""
+        if self._ro_zip is None:
+            self._ro_zip = zipfile.ZipFile(self.path, "r")
+        return self._ro_zip
+
+    def _close_reader(self):
+        """Close the read-only handle so the next read sees fresh content"""
+        if self._ro_zip is not None:
+            self._ro_zip.close()
+            self._ro_zip = None
 
     def _validate_or_create(self):
         """Validate database file or create new one"""
         if not self.path.exists():
             self._create_new_database()
-        elif not zipfile.is_zipfile(self.path):
-            raise DatabaseError(f"Invalid database file: {self.path}")
+        else:
+            # Opening the archive validates it, no separate is_zipfile() pass
+            try:
+                self._refresh_index()
+            except (zipfile.BadZipFile, OSError):
+                raise DatabaseError(f"Invalid database file: {self.path}")
+            self._load_cipher()
+            # Databases without the flag predate record format 2
+            record_format = self._metadata.get("record_format", 1)
+            if record_format > RECORD_FORMAT:
+                raise DatabaseError(
+                    f"Unsupported record format {record_format}: {self.path}"
+                )
+            if record_format < RECORD_FORMAT:
+                self._migrate_records()
+            assert self._stat is not None
+            if (
+                self.config.auto_compact
+                and self._stat[1] > self.config.max_size
+                and self._garbage
+            ):
+                # The live records alone may well fit the limit
+                self.compact()
         self._validate_size()
 
+    def _create_codec(self, backend: str, dict_data: Optional[bytes] = None) -> Codec:
+        """Create the record codec of a backend"""
+        if backend == "zip":
+            return _DeflateCodec()
+        if backend == "zstd":
+            # Map deflate levels 1/6/9 onto zstd's fast/balanced/max tiers
+            level = min(2 * self.config.compression_level + 1, 22)
+            return _ZstdCodec(level, dict_data)
+        raise DatabaseError(f"Unknown backend: {backend}")
+
+    def _file_stat(self) -> Tuple[int, int]:
+        """Get modification time and size of the database file"""
+        stat = self.path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def _refresh_index(self):
+        """Load database metadata and record names from the archive"""
+        self._close_reader()
+        self._cache.clear()
+        zf = self._reader()
+        try:
+            self._metadata = _json_loads(zf.read(METADATA_ENTRY))
+        except KeyError:
+            self._metadata = {}
+        self._tombstones = set(self._metadata.get("tombstones", []))
+        backend = self._metadata.get("backend", "zip")
+        dict_data = (
+            zf.read(ZSTD_DICT_ENTRY) if ZSTD_DICT_ENTRY in zf.NameToInfo else None
+        )
+        if backend != self._codec.name or dict_data != self._codec.dict_data:
+            self._codec = self._create_codec(backend, dict_data)
+        # NameToInfo already holds every entry name once, in archive order
+        names = (
+            name[len("data/") :] for name in zf.NameToInfo if name.startswith("data/")
+        )
+        self._names = {name: None for name in names if name not in self._tombstones}
+        self._garbage = self._garbage_size(zf)
+        self._stat = self._file_stat()
+
+    def _garbage_size(self, zf: zipfile.ZipFile) -> int:
+        """Get the archive bytes taken by shadowed entries and deleted records"""
+        latest = zf.NameToInfo
+        return sum(
+            _ENTRY_OVERHEAD + 2 * len(info.filename) + info.compress_size
+            for info in zf.filelist
+            if latest[info.filename] is not info
+            or self._record_name(info.filename) in self._tombstones
+        )
+
+    def _auto_compact(self):
+        """Compact once garbage dominates the file or pushes it over max_size"""
+        if not self.config.auto_compact or not self._garbage:
+            return
+        assert self._stat is not None
+        size = self._stat[1]
+        if size > self.config.max_size or (
+            self._garbage >= _AUTO_COMPACT_MIN_GARBAGE
+            and self._garbage > size * _AUTO_COMPACT_RATIO
+        ):
+            self.compact()
+
+    def _ensure_index(self):
+        """Rebuild the index if the file was changed outside of this instance"""
+        if self._stat != self._file_stat():
+            self._refresh_index()
+
+    def _load_cipher(self):
+        """Pick the cipher the existing database was written with"""
+        if not self._encryption or not self.config.password:
+            return
+        if not self._metadata.get("encryption", True):
+            raise SecurityError(f"Database is not encrypted: {self.path}")
+        # Databases created before the cipher flag existed use base64 XOR
+        cipher = self._metadata.get("cipher", CIPHER_XOR_LEGACY) or CIPHER_XOR
+        if cipher != self._encryption.cipher:
+            self._encryption = _create_encryption(self.config.password, cipher)
+
     def _create_new_database(self):
         """Create new database with metadata"""
+        self._metadata = {
+            "created_at": datetime.utcnow().isoformat(),
+            "version": self.config.version,
+            "encryption": bool(self._encryption),
+            "cipher": self._encryption.cipher if self._encryption else None,
+            "record_format": RECORD_FORMAT,
+            "backend": self._codec.name,
+        }
         with zipfile.ZipFile(
             self.path,
             "w",
             compression=zipfile.ZIP_DEFLATED,
             compresslevel=self.config.compression_level,
         ) as zf:
-            metadata = {
-                "created_at": datetime.utcnow().isoformat(),
-                "version": self.config.version,
-                "encryption": bool(self._encryption),
-            }
-            zf.writestr("__metadata__.json", json.dumps(metadata))
+            self._write_metadata(zf)
+        self._names = {}
+        self._garbage = 0
+        self._stat = self._file_stat()
+
+    def _write_metadata(self, zf: zipfile.ZipFile):
+        """Write database level metadata, shadowing any previous copy"""
+        self._metadata["tombstones"] = sorted(self._tombstones)
+        self._writestr(zf, METADATA_ENTRY, _json_dumps(self._metadata))
+
+    def _compress_type(self, name: str) -> int:
+        """Small JSON metadata entry is stored, record data uses the codec"""
+        if name in (METADATA_ENTRY, ZSTD_DICT_ENTRY):
+            return zipfile.ZIP_STORED
+        return self._codec.compress_type
+
+    def _record_compress_type(
+        self, payload: bytes, compress_type: Optional[int] = None
+    ) -> int:
+        """
+        Pick the compression method of a record entry.
+
+        :param payload: Record data before encryption
+        :param compress_type: Method requested by the caller, ignored by the
+            zstd backend whose frames are always stored
+        """
+        if not isinstance(self._codec, _DeflateCodec):
+            return self._codec.compress_type
+        if compress_type is not None:
+            if compress_type not in _RECORD_COMPRESS_TYPES:
+                raise DatabaseError(f"Unsupported compress_type: {compress_type}")
+            return compress_type
+        if (
+            # AES output is indistinguishable from random bytes
+            isinstance(self._encryption, AESEncryption)
+            or len(payload) < _STORED_MAX_SIZE
+            or payload.startswith(_COMPRESSED_MAGIC)
+        ):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def _zip_info(
+        self, name: str, compress_type: Optional[int] = None
+    ) -> zipfile.ZipInfo:
+        """Build the header of a new archive entry"""
+        info = zipfile.ZipInfo(name, date_time=_ENTRY_DATE_TIME)
+        info.external_attr = 0o600 << 16
+        info.compress_type = (
+            self._compress_type(name) if compress_type is None else compress_type
+        )
+        return info
+
+    def _writestr(
+        self,
+        zf: zipfile.ZipFile,
+        name: str,
+        data: Union[bytes, str],
+        compress_type: Optional[int] = None,
+    ):
+        """Write an entry that may shadow an older entry with the same name"""
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", "Duplicate name", UserWarning)
+            zf.writestr(
+                self._zip_info(name, compress_type),
+                data,
+                compresslevel=self.config.compression_level,
+            )
+
+    def _write_record(
+        self,
+        zf: zipfile.ZipFile,
+        record: Record,
+        compress_type: Optional[int] = None,
+    ):
+        """Encrypt a record and write it with its metadata as one entry"""
+        stored_data = record._raw_data
+        if self._encryption:
+            stored_data = self._encryption.encrypt(stored_data)
+
+        self._writestr(
+            zf,
+            f"data/{record.name}",
+            self._codec.encode(_pack_record(_json_dumps(record.metadata), stored_data)),
+            self._record_compress_type(record._raw_data, compress_type),
+        )
 
     def _validate_size(self):
         """Check if database size exceeds limit"""
-        if self.path.stat().st_size > self.config.max_size:
+        # The size was stat()ed when the index was last built
+        assert self._stat is not None
+        if self._stat[1] > self.config.max_size:
             raise DatabaseError(
                 f"Database exceeds size limit of {self.config.max_size} bytes"
             )
 
+    def _open_append(self) -> ContextManager[zipfile.ZipFile]:
+        """Open the archive for appending, dropping the cached read handle"""
+        self._close_reader()
+        return _buffered_zip(
+            self.path,
+            "a",
+            compression=zipfile.ZIP_DEFLATED,
+            compresslevel=self.config.compression_level,
+        )
+
     def insert(
-        self, name: str, data: Union[bytes, str], metadata: Optional[Dict] = None
+        self,
+        name: str,
+        data: Union[bytes, str],
+        metadata: Optional[Dict] = None,
+        compress_type: Optional[int] = None,
     ) -> Record:
         """Insert new record with optional metadata"""
-        record = Record(name, data, metadata, self._encryption)
+        return self.insert_many([(name, data)], metadata, compress_type)[0]
 
-        with zipfile.ZipFile(self.path, "a", compression=zipfile.ZIP_DEFLATED) as zf:
-            if f"data/{name}" in zf.namelist():
+    @_locked
+    def insert_many(
+        self,
+        items: Iterable[Tuple[str, Union[bytes, str]]],
+        metadata: Optional[Dict] = None,
+        compress_type: Optional[int] = None,
+    ) -> List[Record]:
+        """
+        Insert several records opening the archive once.
+
+        :param items: Pairs of record name and data
+        :param metadata: Optional metadata copied to every record
+        :param compress_type: zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED, by
+            default small and already compressed payloads are stored
+        :return: Inserted records
+        """
+        self._ensure_index()
+        items = list(items)
+        seen: Set[str] = set()
+        for name, _ in items:
+            if name in self._names or name in seen:
                 raise RecordError(f"Record {name} already exists")
+            seen.add(name)
+
+        records = [
+            Record(name, data, dict(metadata) if metadata else None)
+            for name, data in items
+        ]
+
+        with self._open_append() as zf:
+            for record in records:
+                self._write_record(zf, record, compress_type)
+
+            # Re-inserting a deleted record revives it
+            if not self._tombstones.isdisjoint(seen):
+                self._tombstones -= seen
+                self._write_metadata(zf)
+            self._garbage = self._garbage_size(zf)
+
+        self._names.update(dict.fromkeys(record.name for record in records))
+        for name in seen:
+            self._cache.pop(name)
+        self._stat = self._file_stat()
+        self._auto_compact()
+        return records
+
+    @_locked
+    def get(self, name: str) -> Optional[Record]:
+        """Retrieve a record by name"""
+        self._ensure_index()
+        if name not in self._names:
+            return None
+        return self._load(name)
 
-            # Store data and metadata
-            encrypted_data = record._raw_data
-            if self._encryption:
-                encrypted_data = self._encryption.encrypt(encrypted_data)
+    @_locked
+    def get_many(self, names: Iterable[str], workers: int = 1) -> Dict[str, Record]:
+        """
+        Retrieve several records by name.
 
-            zf.writestr(f"data/{name}", encrypted_data)
-            zf.writestr(f"metadata/{name}.json", json.dumps(record.metadata))
+        :param names: Record names, missing ones are skipped
+        :param workers: Threads inflating uncached entries, only worth raising
+            on multi-core machines for batches of large records
+        :return: Records by name, in request order
+        """
+        self._ensure_index()
+        wanted = [name for name in dict.fromkeys(names) if name in self._names]
+        blobs: Dict[str, bytes] = {}
+        misses = [name for name in wanted if self._cache.peek(name) is None]
+        workers = min(len(misses), workers)
+        if workers > 1:
+            blobs = self._read_entries(misses, workers)
+
+        records = {}
+        for name in wanted:
+            record = self._load(name, blobs.get(name))
+            if record is not None:
+                records[name] = record
+        return records
+
+    def _read_entries(self, names: List[str], workers: int) -> Dict[str, bytes]:
+        """
+        Inflate record entries on a thread pool.
 
-        return record
+        Entries are opened and closed on the calling thread through the cached
+        handle, whose file reads are serialized by zipfile, and only read by
+        the workers: zlib releases the GIL while inflating. Decoding and
+        decryption stay on the calling thread. Entries that fail to read are
+        left out and read again serially, which reports the error.
+        """
+        zf = self._reader()
+        entries: List[Optional[IO[bytes]]] = []
 
-    def get(self, name: str) -> Optional[Record]:
-        """Retrieve a record by name"""
-        with zipfile.ZipFile(self.path, "r") as zf:
+        def read(entry: Optional[IO[bytes]]) -> Optional[bytes]:
+            if entry is None:
+                return None
             try:
-                data_path = f"data/{name}"
-                metadata_path = f"metadata/{name}.json"
-
-                # Read data and metadata
-                data = zf.read(data_path)
-                metadata = json.loads(zf.read(metadata_path))
-
-                # Create and return record
-                record = Record(name, data, metadata, self._encryption)
-                return record
-            except KeyError:
+                return entry.read()
+            except Exception:
                 return None
-            except Exception as e:
-                raise DatabaseError(f"Failed to read record {name}: {str(e)}")
 
+        try:
+            for name in names:
+                try:
+                    entries.append(_open_entry(zf, f"data/{name}"))
+                except Exception:
+                    entries.append(None)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                blobs = list(pool.map(read, entries))
+        finally:
+            for entry in entries:
+                if entry is not None:
+                    entry.close()
+        return {name: blob for name, blob in zip(names, blobs) if blob is not None}
+
+    def _load(self, name: str, blob: Optional[bytes] = None) -> Optional[Record]:
+        """Build an indexed record from the cache, a prefetched entry or the archive"""
+        try:
+            cached = self._cache.get(name)
+            if cached is None:
+                cached = self._read_raw(name, blob)
+                self._cache.put(name, cached)
+            data, metadata = cached
+
+            # Create and return record
+            record = Record._from_storage(name, data, _json_loads(metadata))
+            return record
+        except KeyError:
+            return None
+        except Exception as e:
+            raise DatabaseError(f"Failed to read record {name}: {str(e)}")
+
+    def _read_raw(self, name: str, blob: Optional[bytes] = None) -> Tuple[bytes, bytes]:
+        """Read decrypted data and serialized metadata of a record"""
+        if blob is None:
+            # Read data and metadata with a single entry read
+            with _open_entry(self._reader(), f"data/{name}") as f:
+                blob = f.read()
+        metadata, payload = _unpack_record(self._codec.decode(blob))
+        if self._encryption:
+            return self._encryption.decrypt(payload), metadata
+        return bytes(payload), metadata
+
+    def _read_metadata(self, name: str) -> Dict[str, Any]:
+        """Read the metadata of a record without decrypting its payload"""
+        cached = self._cache.peek(name)
+        if cached is not None:
+            return _json_loads(cached[1])
+
+        with _open_entry(self._reader(), f"data/{name}") as f:
+            if isinstance(self._codec, _ZstdCodec):
+                metadata, _ = _unpack_record(self._codec.decode(f.read()))
+            else:
+                # Only the header is inflated, the payload is never read
+                size = int.from_bytes(f.read(_HEADER_SIZE), "big")
+                metadata = f.read(size)
+        return _json_loads(metadata)
+
+    @_locked
+    def cache_info(self) -> Dict[str, int]:
+        """Get record cache statistics"""
+        return {
+            "hits": self._cache.hits,
+            "misses": self._cache.misses,
+            "size": len(self._cache),
+            "maxsize": self._cache.maxsize,
+        }
+
+    @_locked
     def update(
-        self, name: str, data: Union[bytes, str], metadata: Optional[Dict] = None
+        self,
+        name: str,
+        data: Union[bytes, str],
+        metadata: Optional[Dict] = None,
+        compress_type: Optional[int] = None,
     ) -> Record:
-        """Update an existing record with proper preservation of all records"""
+        """
+        Update an existing record.
+
+        New entries are appended and shadow the previous ones, which stay in
+        the archive until the next compact(). compress_type works as in
+        insert_many().
+        """
+        # Encode once, the size and the new record share the same bytes
+        data = _as_bytes(data)
+
         # First, verify record exists
-        existing_record = self.get(name)
-        if not existing_record:
+        self._ensure_index()
+        if name not in self._names:
             raise RecordError(f"Record {name} does not exist")
+        try:
+            existing_metadata = self._read_metadata(name)
+        except Exception as e:
+            raise DatabaseError(f"Failed to read record {name}: {str(e)}")
 
         # Create new metadata or update existing
-        new_metadata = existing_record.metadata.copy() if metadata is None else metadata
+        new_metadata = existing_metadata if metadata is None else metadata
         new_metadata.update(
             {
                 "updated_at": datetime.utcnow().isoformat(),
-                "previous_checksum": existing_record.metadata.get("checksum"),
-                "size": len(data if isinstance(data, bytes) else data.encode("utf-8")),
+                "previous_checksum": existing_metadata.get("checksum"),
+                "size": len(data),
             }
         )
 
         # Create new record
-        new_record = Record(name, data, new_metadata, self._encryption)
-
-        # Prepare data for storage
-        encrypted_data = new_record._raw_data
-        if self._encryption:
-            encrypted_data = self._encryption.encrypt(encrypted_data)
-
-        temp_path = Path(tempfile.mktemp())
+        new_record = Record(name, data, new_metadata)
 
+        self._cache.pop(name)
         try:
-            # Create new zip file with all existing content plus updated record
-            with zipfile.ZipFile(self.path, "r") as src_zip:
-                # Get list of all files excluding the ones we're updating
-                files_to_copy = [
-                    f
-                    for f in src_zip.namelist()
-                    if not (f == f"data/{name}" or f == f"metadata/{name}.json")
-                ]
-
-                with zipfile.ZipFile(
-                    temp_path,
-                    "w",
-                    compression=zipfile.ZIP_DEFLATED,
-                    compresslevel=self.config.compression_level,
-                ) as dst_zip:
-                    # Copy existing files
-                    for item in files_to_copy:
-                        dst_zip.writestr(item, src_zip.read(item))
-
-                    # Write updated record and metadata
-                    dst_zip.writestr(f"data/{name}", encrypted_data)
-                    dst_zip.writestr(
-                        f"metadata/{name}.json", json.dumps(new_record.metadata)
-                    )
-
-            # Verify the temp file
-            with zipfile.ZipFile(temp_path, "r") as check_zip:
-                all_files = check_zip.namelist()
-                data_files = [f for f in all_files if f.startswith("data/")]
-                assert len(data_files) == len(
-                    set(data_files)
-                ), "Duplicate data files found"
-
-            # Replace original file with updated version
-            shutil.move(str(temp_path), str(self.path))
+            with self._open_append() as zf:
+                self._write_record(zf, new_record, compress_type)
+                self._garbage = self._garbage_size(zf)
+            self._stat = self._file_stat()
+            self._auto_compact()
             return new_record
 
         except Exception as e:
-            if temp_path.exists():
-                temp_path.unlink()
             raise DatabaseError(f"Update failed: {str(e)}")
 
     def delete(self, name: str) -> bool:
-        """Delete a record"""
-        temp_path = Path(tempfile.mktemp())
-
-        with zipfile.ZipFile(self.path, "r") as src_zip:
-            with zipfile.ZipFile(
-                temp_path,
-                "w",
-                compression=zipfile.ZIP_DEFLATED,
-                compresslevel=self.config.compression_level,
-            ) as dst_zip:
-                for item in src_zip.namelist():
-                    if not (
-                        item.startswith(f"data/{name}")
-                        or item.startswith(f"metadata/{name}")
-                    ):
-                        dst_zip.writestr(item, src_zip.read(item))
-
-        shutil.move(temp_path, self.path)
+        """Delete a record, its entries are reclaimed by compact()"""
+        return self.delete_many([name])
+
+    @_locked
+    def delete_many(self, names: Iterable[str]) -> bool:
+        """Delete several records with a single metadata write"""
+        self._ensure_index()
+        # Unknown names need no tombstone, skip the write if none are left
+        names = {name for name in names if name in self._names}
+        if not names:
+            return True
+        with self._open_append() as zf:
+            self._tombstones |= names
+            self._write_metadata(zf)
+            self._garbage = self._garbage_size(zf)
+        for name in names:
+            self._names.pop(name, None)
+            self._cache.pop(name)
+        self._stat = self._file_stat()
+        self._auto_compact()
         return True
 
+    @_locked
     def list_records(self) -> List[str]:
         """List all record names"""
-        with zipfile.ZipFile(self.path, "r") as zf:
-            return [
-                name.split("/")[-1]
-                for name in zf.namelist()
-                if name.startswith("data/")
-            ]
+        self._ensure_index()
+        return list(self._names)
 
+    @_locked
     def search(self, pattern: str) -> List[str]:
         """Search records by name pattern"""
-        all_records = self.list_records()
-        return [name for name in all_records if pattern in name]
+        self._ensure_index()
+        return [name for name in self._names if pattern in name]
 
-    def compact(self):
-        """Compact database by removing deleted records and optimizing storage"""
-        temp_path = Path(tempfile.mktemp())
+    @staticmethod
+    def _record_name(entry: str) -> Optional[str]:
+        """Get the record name an archive entry belongs to"""
+        if entry.startswith("data/"):
+            return entry[len("data/") :]
+        return None
 
-        with zipfile.ZipFile(self.path, "r") as src_zip:
-            with zipfile.ZipFile(
-                temp_path,
-                "w",
-                compression=zipfile.ZIP_DEFLATED,
-                compresslevel=self.config.compression_level,
-            ) as dst_zip:
-                for item in src_zip.namelist():
-                    dst_zip.writestr(item, src_zip.read(item))
+    def _rewrite(
+        self,
+        keep: Callable[[str], bool],
+        convert: Optional[Callable[[zipfile.ZipFile, str, bytes], bytes]] = None,
+        extra_entries: Optional[Dict[str, bytes]] = None,
+    ):
+        """
+        Rewrite the archive with the latest version of every kept entry.
+
+        :param keep: Predicate over entry names, metadata is always rewritten
+        :param convert: Optional function building the new content of an
+            entry from the source archive, entry name and current content
+        :param extra_entries: New entries added to the archive
+        """
+        self._close_reader()
+        # Same directory as the database so os.replace is a cheap atomic rename
+        fd, temp_name = tempfile.mkstemp(dir=self.path.parent, suffix=".zip.tmp")
+        os.close(fd)
+        temp_path = Path(temp_name)
 
-        shutil.move(temp_path, self.path)
+        try:
+            with _buffered_zip(self.path, "r") as src_zip:
+                # Later entries shadow earlier ones with the same name, which
+                # NameToInfo already resolves
+                latest = src_zip.NameToInfo
+
+                with _buffered_zip(
+                    temp_path,
+                    "w",
+                    sync=self.config.durable,
+                    compression=zipfile.ZIP_DEFLATED,
+                    compresslevel=self.config.compression_level,
+                ) as dst_zip:
+                    for item, info in latest.items():
+                        if item == METADATA_ENTRY or not keep(item):
+                            continue
+                        if convert is None:
+                            # Stored entries were stored on purpose, entries
+                            # using another method are recompressed
+                            if info.compress_type in (
+                                zipfile.ZIP_STORED,
+                                self._compress_type(item),
+                            ):
+                                self._copy_raw(src_zip, info, dst_zip)
+                            else:
+                                self._copy_stream(src_zip, info, dst_zip)
+                            continue
+                        with _open_entry(src_zip, info) as f:
+                            data = f.read()
+                        self._writestr(dst_zip, item, convert(src_zip, item, data))
+                    for item, data in (extra_entries or {}).items():
+                        self._writestr(dst_zip, item, data)
+                    self._write_metadata(dst_zip)
+                    # Records kept while still tombstoned, none after compact()
+                    garbage = self._garbage_size(dst_zip)
+
+            # mkstemp creates the file owner-only, keep the original mode
+            shutil.copymode(self.path, temp_path)
+            os.replace(temp_path, self.path)
+            if self.config.durable:
+                _fsync_dir(self.path.parent)
+        except Exception:
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+        self._garbage = garbage
+        self._stat = self._file_stat()
+
+    def _migrate_records(self):
+        """Fold format 1 metadata/{name}.json entries into record entries"""
+
+        def convert(src_zip: zipfile.ZipFile, item: str, data: bytes) -> bytes:
+            if not item.startswith("data/"):
+                return data
+            try:
+                metadata = src_zip.read(f"metadata/{self._record_name(item)}.json")
+            except KeyError:
+                metadata = b"{}"
+            return self._codec.encode(_pack_record(metadata, data))
+
+        self._metadata["record_format"] = RECORD_FORMAT
+        self._rewrite(lambda item: not item.startswith("metadata/"), convert)
+
+    def _copy_raw(
+        self,
+        src_zip: zipfile.ZipFile,
+        src_info: zipfile.ZipInfo,
+        dst_zip: zipfile.ZipFile,
+    ):
+        """Copy the compressed bytes of an entry without inflating them"""
+        src_fp: Any = src_zip.fp
+        src_fp.seek(src_info.header_offset)
+        header = _LOCAL_HEADER.unpack(src_fp.read(_LOCAL_HEADER.size))
+        if header[0] != _LOCAL_HEADER_SIGNATURE:
+            raise DatabaseError(f"Bad local header of entry {src_info.filename}")
+        # Skip the file name and extra field of the local header
+        src_fp.seek(header[-2] + header[-1], os.SEEK_CUR)
+        raw = src_fp.read(src_info.compress_size)
+
+        info = self._zip_info(src_info.filename)
+        info.compress_type = src_info.compress_type
+        info.CRC = src_info.CRC
+        info.compress_size = src_info.compress_size
+        info.file_size = src_info.file_size
+
+        dst: Any = dst_zip
+        info.header_offset = dst.fp.tell()
+        dst.fp.write(info.FileHeader())
+        dst.fp.write(raw)
+        dst.filelist.append(info)
+        dst.NameToInfo[info.filename] = info
+        # Keep zipfile's bookkeeping so later writes and the central directory
+        # land after the copied entry
+        dst.start_dir = dst.fp.tell()
+        dst._didModify = True
+
+    def _copy_stream(
+        self,
+        src_zip: zipfile.ZipFile,
+        src_info: zipfile.ZipInfo,
+        dst_zip: zipfile.ZipFile,
+    ):
+        """Recompress an entry chunk by chunk without holding it in memory"""
+        info = self._zip_info(src_info.filename)
+        info.file_size = src_info.file_size
+        # writestr() is given the level explicitly, streamed writes read it here
+        info._compresslevel = (  # type: ignore[attr-defined]
+            self.config.compression_level
+        )
+        force_zip64 = src_info.file_size > zipfile.ZIP64_LIMIT
+        with _open_entry(src_zip, src_info) as src, dst_zip.open(
+            info, "w", force_zip64=force_zip64
+        ) as dst:
+            shutil.copyfileobj(src, dst, _BUFFER_SIZE)
+
+    @_locked
+    def compact(self):
+        """Compact database by removing deleted records and optimizing storage"""
+        self._ensure_index()
+        tombstones = self._tombstones
+        self._tombstones = set()
+        try:
+            if isinstance(self._codec, _ZstdCodec) and self._codec.dict_data is None:
+                self._compact_with_dictionary(tombstones)
+            else:
+                self._rewrite(lambda item: self._record_name(item) not in tombstones)
+        except Exception:
+            self._tombstones = tombstones
+            raise
+
+    def _compact_with_dictionary(self, tombstones: Set[str]):
+        """Train a zstd dictionary on live records and recompress them with it"""
+        zf = self._reader()
+        names = [name for name in self._names if name not in tombstones]
+        samples = [self._codec.decode(zf.read(f"data/{name}")) for name in names]
+        dict_data = None
+        if len(samples) >= _ZSTD_DICT_MIN_SAMPLES:
+            dict_data = _ZstdCodec.train(samples)
+        if dict_data is None:
+            self._rewrite(lambda item: self._record_name(item) not in tombstones)
+            return
+
+        old_codec = self._codec
+        new_codec = self._create_codec(old_codec.name, dict_data)
+
+        def convert(src_zip: zipfile.ZipFile, item: str, data: bytes) -> bytes:
+            if not item.startswith("data/"):
+                return data
+            return new_codec.encode(old_codec.decode(data))
+
+        self._rewrite(
+            lambda item: self._record_name(item) not in tombstones,
+            convert,
+            {ZSTD_DICT_ENTRY: dict_data},
+        )
+        self._codec = new_codec
 
+    @_locked
     def backup(self, backup_path: Union[str, Path]):
         """Create a backup of the database"""
         backup_path = Path(backup_path)